@@ -1,6 +1,10 @@
 from . import vanna_config
 from . import vanna_chatbot
+from . import vanna_cache
+from . import vanna_json
 from . import vanna_llm_service
 from . import vanna_sql_tool
 from . import vanna_user_resolver
-from . import vanna_agent_memory
\ No newline at end of file
+from . import vanna_agent_memory
+from . import vanna_conversation_store
+from . import vanna_context_enricher
\ No newline at end of file
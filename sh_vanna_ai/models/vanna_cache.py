@@ -0,0 +1,67 @@
+"""
+Small in-memory caches shared by the Vanna services
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed time
+
+    Values are stored and returned as is; callers that hand them out to
+    code that may mutate them are responsible for copying.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        Initialize the cache
+
+        Args:
+            maxsize: Maximum number of entries, least recently used evicted first
+            ttl: Seconds an entry stays valid
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached value
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._data[key]
+                self.stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries over maxsize
+
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
@@ -1,17 +1,234 @@
 import logging
 import asyncio
-from odoo import models, api
+import concurrent.futures
+import os
+import threading
+from odoo import models, api, tools
 from odoo.exceptions import UserError
 from .vanna_llm_service import LocalLlamaCppLlmService
 from .vanna_sql_tool import OdooSqlTool
 from .vanna_user_resolver import OdooUserResolver
 from .vanna_agent_memory import NoOpAgentMemory
-from vanna import Agent
+from .vanna_conversation_store import NoOpConversationStore
+from .vanna_context_enricher import OdooEnvContextEnricher, current_odoo_env
+from .vanna_json import json_loads
+from vanna import Agent, AgentConfig
 from vanna.core.registry import ToolRegistry
 from vanna.core.user import RequestContext
 
 _logger = logging.getLogger(__name__)
 
+# Seconds to wait for the agent to answer a single query
+AGENT_TIMEOUT = 60
+
+# Shared event loop running in a daemon thread, one per worker process
+_background_loop = None
+_background_loop_pid = None
+_background_loop_lock = threading.Lock()
+
+# Agents cached per (config id, llm port)
+_agent_cache = {}
+_agent_cache_lock = threading.Lock()
+
+# Parsed schema info and prompt prefix per database, reused until
+# _train_vanna stores a new schema version
+_schema_cache = {}
+
+# Questions answered directly, without running the agent
+GREETINGS = frozenset({'hi', 'hey', 'hello', 'yo', 'ok'})
+
+# Per-request context section of the system prompt
+CONTEXT_TEMPLATE = "Current context: Table '{table}' ({name})\n{fields}{record}"
+FIELD_TEMPLATE = "  - {name} ({ttype}): {description}"
+
+# Opening lines of the system prompt
+PROMPT_HEADER = (
+    "You are a helpful AI assistant for Odoo, an ERP system.",
+    "You can answer questions about the database and execute SQL queries.",
+    "When users ask about data, use the run_sql tool to query the database.",
+    "Only SELECT queries are allowed for safety.",
+    "",
+)
+
+
+def _get_background_loop():
+    """
+    Get the shared background event loop, starting it if needed
+
+    The loop is started lazily and keyed on the process id so that forked
+    Odoo workers each get their own loop thread instead of inheriting a
+    dead one from the parent.
+
+    Returns:
+        Running asyncio event loop
+    """
+    global _background_loop, _background_loop_pid
+
+    pid = os.getpid()
+    if _background_loop is not None and _background_loop_pid == pid:
+        return _background_loop
+
+    with _background_loop_lock:
+        if _background_loop is None or _background_loop_pid != pid:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever,
+                name='vanna-agent-loop',
+                daemon=True
+            )
+            thread.start()
+            _background_loop = loop
+            _background_loop_pid = pid
+
+    return _background_loop
+
+
+# Marks an attribute the component class doesn't have
+_MISSING = object()
+
+# Field extractors for UI component classes, built on first sight of a class
+_EXTRACTORS = {}
+
+
+def _build_extractor(sample):
+    """
+    Build a field extractor for the class of a UI component
+
+    The attributes present on the class are resolved once, so extracting
+    from later instances is plain attribute access without reflection.
+
+    Args:
+        sample: First seen instance of the component class
+
+    Returns:
+        Function mapping a component to (text, sql, data, columns), with
+        _MISSING for attributes the class doesn't have
+    """
+    if hasattr(sample, 'text'):
+        text_attr = 'text'
+    elif hasattr(sample, 'content'):
+        text_attr = 'content'
+    else:
+        text_attr = None
+
+    sql_attr = 'sql' if hasattr(sample, 'sql') else None
+
+    if hasattr(sample, 'data'):
+        data_attr = 'data'
+    elif hasattr(sample, 'rows'):
+        data_attr = 'rows'
+    else:
+        data_attr = None
+
+    columns_attr = 'columns' if hasattr(sample, 'columns') else None
+
+    def extract(component):
+        return (
+            getattr(component, text_attr) if text_attr else _MISSING,
+            getattr(component, sql_attr) if sql_attr else _MISSING,
+            getattr(component, data_attr) if data_attr else _MISSING,
+            getattr(component, columns_attr) if columns_attr else [],
+        )
+
+    return extract
+
+
+class ComponentAccumulator:
+    """Accumulate UI components from Agent.send_message into a response dict"""
+
+    def __init__(self):
+        self.count = 0
+        # Response text fragments, joined once in finalize()
+        self.response_parts = []
+        self.result = {
+            'response': '',
+            'sql': None,
+            'results': None,
+            'error': False
+        }
+
+    def ingest(self, component):
+        """
+        Merge a single UI component into the response
+
+        Args:
+            component: UI component yielded by the agent
+        """
+        self.count += 1
+        result = self.result
+        response_parts = self.response_parts
+
+        try:
+            # Check component type and extract relevant information
+            # (rendering a component for the log is costly, so only when needed)
+            if _logger.isEnabledFor(logging.DEBUG):
+                component_type = type(component).__name__
+                _logger.debug(f'Processing component type: {component_type}, component: {component}')
+
+            # UiComponent has rich_component and simple_component
+            # Extract the actual component data
+            actual_component = getattr(component, 'rich_component', _MISSING)
+            if actual_component is _MISSING:
+                actual_component = getattr(component, 'simple_component', None) or component
+
+            extractor = _EXTRACTORS.get(type(actual_component))
+            if extractor is None:
+                extractor = _build_extractor(actual_component)
+                _EXTRACTORS[type(actual_component)] = extractor
+            text, sql, data, columns = extractor(actual_component)
+
+            # Check for text content in simple_component or rich_component
+            if text is not _MISSING and text:
+                response_parts.append(str(text))
+
+            # Check for SQL
+            if sql is not _MISSING:
+                result['sql'] = sql
+
+            # Check for table/data
+            if data is not _MISSING and data:
+                result['results'] = {
+                    'columns': columns if columns else [],
+                    'rows': data if isinstance(data, list) else [data],
+                    'count': len(data) if isinstance(data, list) else 1
+                }
+
+            # Fallback: components without known fields are added as strings
+            if not response_parts and not result['sql'] and not result['results']:
+                component_str = str(actual_component)
+                if component_str and component_str not in ['None', '']:
+                    response_parts.append(component_str)
+
+        except Exception as e:
+            _logger.warning(f'Error processing component {component}: {str(e)}', exc_info=True)
+            # Try to add as string as fallback
+            try:
+                response_parts.append(str(component))
+            except:
+                pass
+
+    def finalize(self):
+        """
+        Finish accumulation and return the response
+
+        Returns:
+            Dict with response, sql, and results
+        """
+        result = self.result
+
+        if not self.count:
+            result['response'] = 'No response generated.'
+            return result
+
+        # Clean up response
+        result['response'] = '\n'.join(self.response_parts).strip()
+
+        # If no response at all, add a default message
+        if not result['response'] and not result['sql'] and not result['results']:
+            result['response'] = 'I received your message but could not generate a response.'
+
+        return result
+
 
 class VannaChatbot(models.Model):
     _name = 'vanna.chatbot'
@@ -20,24 +237,53 @@ class VannaChatbot(models.Model):
     def _get_agent(self, config):
         """
         Get or create Vanna 2.0 Agent instance
-        
+
+        Agents are cached per config and port. None of the services hold an
+        Odoo env; the current env is provided per request through
+        current_odoo_env and OdooEnvContextEnricher.
+
         Args:
             config: Vanna config record
-            
+
+        Returns:
+            Agent instance
+        """
+        key = (config.id, config.llm_port)
+        agent = _agent_cache.get(key)
+        if agent is not None:
+            return agent
+
+        with _agent_cache_lock:
+            agent = _agent_cache.get(key)
+            if agent is None:
+                agent = self._create_agent(config)
+                _agent_cache[key] = agent
+
+        return agent
+
+    def _create_agent(self, config):
+        """
+        Create a new Vanna 2.0 Agent instance
+
+        Args:
+            config: Vanna config record
+
         Returns:
             Agent instance
         """
         # Create LLM service
         llm_url = f"http://localhost:{config.llm_port}/completion"
+        # llama-server applies the model's chat template on this endpoint
+        chat_url = f"http://localhost:{config.llm_port}/v1/chat/completions"
         llm_service = LocalLlamaCppLlmService(
             llm_url=llm_url,
             temperature=0.1,
-            max_tokens=500
+            max_tokens=500,
+            chat_url=chat_url
         )
 
-        # Create SQL tool with Odoo environment
-        # Store env reference in the tool
-        sql_tool = OdooSqlTool(env=self.env)
+        # Create SQL tool; it reads the Odoo env from the tool context
+        sql_tool = OdooSqlTool()
 
         # Create tool registry and register tool
         # ToolRegistry uses register_local_tool(tool, access_groups) method
@@ -46,19 +292,84 @@ class VannaChatbot(models.Model):
         tool_registry.register_local_tool(sql_tool, access_groups=[])
 
         # Create user resolver and agent memory
-        user_resolver = OdooUserResolver(env=self.env)
+        user_resolver = OdooUserResolver()
         agent_memory = NoOpAgentMemory()
 
         # Create agent with all required parameters
+        # Conversations are not stored, so a cached agent doesn't grow over time
         agent = Agent(
             llm_service=llm_service,
             tool_registry=tool_registry,
             user_resolver=user_resolver,
-            agent_memory=agent_memory
+            agent_memory=agent_memory,
+            conversation_store=NoOpConversationStore(),
+            context_enrichers=[OdooEnvContextEnricher()],
+            # Sampling parameters travel in each LlmRequest, so they are set
+            # on the agent to match the LLM service
+            config=AgentConfig(
+                temperature=llm_service.temperature,
+                max_tokens=llm_service.max_tokens
+            )
         )
 
         return agent
 
+    def _get_schema_cache(self):
+        """
+        Get schema information stored by _train_vanna
+
+        The parsed schema and the static prompt prefix built from it are
+        cached in memory per database and only rebuilt when the stored
+        schema version changes. The version parameter is served from
+        Odoo's ormcache, so an unchanged schema costs no query at all.
+
+        Returns:
+            Dict with 'version', 'schema' and 'prefix'
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        version = params.get_param('vanna.schema_version')
+        cached = _schema_cache.get(self.env.cr.dbname)
+        if version and cached and cached['version'] == version:
+            return cached
+
+        schema = None
+        schema_info = params.get_param('vanna.schema_info')
+        if schema_info:
+            try:
+                schema = json_loads(schema_info)
+            except ValueError:
+                pass
+
+        entry = {
+            'version': version,
+            'schema': schema,
+            'prefix': self._build_prompt_prefix(schema),
+        }
+        if version:
+            _schema_cache[self.env.cr.dbname] = entry
+        return entry
+
+    def _build_prompt_prefix(self, schema):
+        """
+        Build the static part of the system prompt
+
+        Args:
+            schema: List of table info dicts, or None
+
+        Returns:
+            Prompt prefix string
+        """
+        prompt_parts = list(PROMPT_HEADER)
+
+        # Add schema information
+        if schema:
+            prompt_parts.append("Available database tables:")
+            for table_info in schema[:10]:  # Limit to first 10 tables
+                prompt_parts.append(f"- {table_info['table']} ({table_info['name']})")
+            prompt_parts.append("")
+
+        return "\n".join(prompt_parts)
+
     def _build_system_prompt(self, context):
         """
         Build system prompt with Odoo context and schema information
@@ -69,55 +380,103 @@ class VannaChatbot(models.Model):
         Returns:
             System prompt string
         """
-        prompt_parts = [
-            "You are a helpful AI assistant for Odoo, an ERP system.",
-            "You can answer questions about the database and execute SQL queries.",
-            "When users ask about data, use the run_sql tool to query the database.",
-            "Only SELECT queries are allowed for safety.",
-            ""
-        ]
-
-        # Add schema information
-        schema_info = self.env['ir.config_parameter'].sudo().get_param('vanna.schema_info')
-        if schema_info:
-            import json
-            try:
-                schema = json.loads(schema_info)
-                prompt_parts.append("Available database tables:")
-                for table_info in schema[:10]:  # Limit to first 10 tables
-                    prompt_parts.append(f"- {table_info['table']} ({table_info['name']})")
-                prompt_parts.append("")
-            except:
-                pass
+        prefix = self._get_schema_cache()['prefix']
 
         # Add current context
         if context:
             if context.get('model_name'):
-                model = self.env['ir.model'].search([
-                    ('model', '=', context['model_name'])
-                ], limit=1)
-
-                if model:
-                    table_name = model.model.replace('.', '_')
-                    prompt_parts.append(f"Current context: Table '{table_name}' ({model.name})")
+                metadata = self._get_model_metadata(context['model_name'], self.env.lang or 'en_US')
 
-                    if context.get('field_names'):
-                        fields = self.env['ir.model.fields'].search([
-                            ('model_id', '=', model.id),
-                            ('name', 'in', context['field_names'])
-                        ], limit=10)
+                if metadata:
+                    model_name, model_label, _info, model_fields = metadata
 
-                        if fields:
-                            prompt_parts.append("Relevant fields:")
-                            for field in fields:
-                                prompt_parts.append(f"  - {field.name} ({field.ttype}): {field.field_description}")
+                    fields_block = ''
+                    field_names = set(context.get('field_names') or ())
+                    field_lines = [
+                        FIELD_TEMPLATE.format(name=name, ttype=ttype, description=description)
+                        for name, description, ttype, _required in model_fields
+                        if name in field_names
+                    ][:10]
+                    if field_lines:
+                        fields_block = "Relevant fields:\n" + "\n".join(field_lines) + "\n"
 
+                    record_block = ''
                     if context.get('record_id'):
-                        prompt_parts.append(f"Current record ID: {context['record_id']}")
+                        record_block = f"Current record ID: {context['record_id']}\n"
 
-                    prompt_parts.append("")
+                    return prefix + "\n" + CONTEXT_TEMPLATE.format(
+                        table=model_name.replace('.', '_'),
+                        name=model_label,
+                        fields=fields_block,
+                        record=record_block,
+                    )
 
-        return "\n".join(prompt_parts)
+        return prefix
+
+    @tools.ormcache('model_name', 'lang')
+    def _get_model_metadata(self, model_name, lang):
+        """
+        Get ir.model and ir.model.fields metadata for a model
+
+        The result is cached per registry, so it is only queried again after
+        the registry is reloaded, e.g. when a module is installed or updated.
+
+        Args:
+            model_name: Technical model name, e.g. 'res.partner'
+            lang: Language code for translated labels
+
+        Returns:
+            Tuple (model, name, info, fields), fields being a tuple of
+            (name, description, ttype, required) sorted by name, or None if
+            the model doesn't exist
+        """
+        # Model and all of its fields in a single round-trip
+        # (name and field_description are translated JSONB columns)
+        self.env.cr.execute("""
+            SELECT im.model,
+                   COALESCE(im.name->>%(lang)s, im.name->>'en_US'),
+                   im.info,
+                   imf.name,
+                   COALESCE(imf.field_description->>%(lang)s, imf.field_description->>'en_US'),
+                   imf.ttype,
+                   imf.required
+            FROM ir_model im
+            LEFT JOIN ir_model_fields imf ON imf.model_id = im.id
+            WHERE im.model = %(model)s
+            ORDER BY imf.name
+        """, {
+            'lang': lang,
+            'model': model_name,
+        })
+        rows = self.env.cr.fetchall()
+
+        if not rows:
+            return None
+
+        model, name, info = rows[0][:3]
+        fields = tuple(
+            (field_name, description, ttype, bool(required))
+            for _model, _name, _info, field_name, description, ttype, required in rows
+            if field_name
+        )
+        return (model, name, info, fields)
+
+    def _quick_response(self, text):
+        """
+        Build a response that doesn't need the agent
+
+        Args:
+            text: Response text
+
+        Returns:
+            Dict in the same format as process_query results
+        """
+        return {
+            'response': text,
+            'sql': None,
+            'results': None,
+            'error': False
+        }
 
     @api.model
     def process_query(self, question, context=None):
@@ -131,6 +490,13 @@ class VannaChatbot(models.Model):
         Returns:
             Dict with response and any SQL results
         """
+        # Answer empty questions and greetings without touching the agent
+        question = (question or '').strip()
+        if not question:
+            return self._quick_response('Please enter a question.')
+        if question.lower() in GREETINGS:
+            return self._quick_response('Hello! Ask me about your data.')
+
         try:
             config = self.env['vanna.config'].search([], limit=1)
             if not config or config.llm_status != 'running':
@@ -142,7 +508,7 @@ class VannaChatbot(models.Model):
             # Get agent
             agent = self._get_agent(config)
             
-            # Create request context (empty, since we use Odoo env directly in resolver)
+            # Create request context carrying the Odoo env for the resolver
             request_context = RequestContext(
                 cookies={},
                 headers={},
@@ -152,52 +518,35 @@ class VannaChatbot(models.Model):
             )
             
             # Process query using agent
-            # Note: Vanna 2.0 Agent.send_message is async, so we need to handle it
+            # Note: Vanna 2.0 Agent.send_message is async, so we run it on the
+            # shared background event loop and wait for the result here
             try:
-                # Try to get existing event loop
+                # send_message returns an async generator; components are
+                # merged into the response as they arrive instead of buffered
+                env = self.env
+
+                async def collect_response():
+                    current_odoo_env.set(env)
+                    accumulator = ComponentAccumulator()
+                    async for component in agent.send_message(request_context, question):
+                        accumulator.ingest(component)
+                    return accumulator
+
+                future = asyncio.run_coroutine_threadsafe(
+                    collect_response(), _get_background_loop()
+                )
                 try:
-                    loop = asyncio.get_event_loop()
-                    if loop.is_closed():
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-
-                # Run the agent send_message
-                # send_message returns an async generator, so we need to collect all components
-                if loop.is_running():
-                    # If loop is already running, we need to use a different approach
-                    # For Odoo, we'll use run_until_complete in a new thread
-                    import concurrent.futures
-                    async def collect_response():
-                        components = []
-                        async for component in agent.send_message(request_context, question):
-                            components.append(component)
-                        return components
-                    
-                    with concurrent.futures.ThreadPoolExecutor() as executor:
-                        future = executor.submit(
-                            asyncio.run,
-                            collect_response()
-                        )
-                        components = future.result(timeout=60)
-                else:
-                    async def collect_response():
-                        components = []
-                        async for component in agent.send_message(request_context, question):
-                            components.append(component)
-                        return components
-                    
-                    components = loop.run_until_complete(collect_response())
-                
-                _logger.info(f'Received {len(components)} components from agent')
-                
-                # Process components into response
-                response = self._process_agent_components(components)
-                _logger.info(f'Processed response: {response}')
-                result = response
-                
+                    accumulator = future.result(timeout=AGENT_TIMEOUT)
+                except concurrent.futures.TimeoutError:
+                    future.cancel()
+                    raise
+
+                _logger.info(f'Received {accumulator.count} components from agent')
+
+                # Build final response from accumulated components
+                result = accumulator.finalize()
+                _logger.info(f'Processed response: {result}')
+
             except Exception as async_error:
                 _logger.error(f'Async execution error: {str(async_error)}', exc_info=True)
                 result = {
@@ -214,144 +563,27 @@ class VannaChatbot(models.Model):
                 'message': f'Error processing query: {str(e)}'
             }
     
-    def _process_agent_components(self, components):
-        """
-        Process UI components from Agent.send_message into response format
-        
-        Args:
-            components: List of UI components from agent
-            
-        Returns:
-            Dict with response, sql, and results
-        """
-        result = {
-            'response': '',
-            'sql': None,
-            'results': None,
-            'error': False
-        }
-        
-        if not components:
-            result['response'] = 'No response generated.'
-            return result
-        
-        # Process components
-        for component in components:
-            try:
-                # Check component type and extract relevant information
-                component_type = type(component).__name__
-                _logger.debug(f'Processing component type: {component_type}, component: {component}')
-                
-                # UiComponent has rich_component and simple_component
-                # Extract the actual component data
-                actual_component = None
-                if hasattr(component, 'rich_component'):
-                    actual_component = component.rich_component
-                elif hasattr(component, 'simple_component') and component.simple_component:
-                    actual_component = component.simple_component
-                else:
-                    actual_component = component
-                
-                # Try to get component as dict first (Pydantic models can be converted)
-                if hasattr(actual_component, 'model_dump'):
-                    component_dict = actual_component.model_dump()
-                elif hasattr(actual_component, 'dict'):
-                    component_dict = actual_component.dict()
-                elif hasattr(component, 'model_dump'):
-                    component_dict = component.model_dump()
-                elif hasattr(component, 'dict'):
-                    component_dict = component.dict()
-                else:
-                    component_dict = {}
-                
-                _logger.debug(f'Component dict: {component_dict}')
-                
-                # Check for text content in simple_component or rich_component
-                if hasattr(actual_component, 'text'):
-                    text = actual_component.text
-                    if text:
-                        result['response'] += str(text) + '\n'
-                elif 'text' in component_dict:
-                    result['response'] += str(component_dict['text']) + '\n'
-                elif hasattr(actual_component, 'content'):
-                    content = actual_component.content
-                    if content:
-                        result['response'] += str(content) + '\n'
-                elif 'content' in component_dict:
-                    result['response'] += str(component_dict['content']) + '\n'
-                
-                # Check for SQL
-                if hasattr(actual_component, 'sql'):
-                    result['sql'] = actual_component.sql
-                elif 'sql' in component_dict:
-                    result['sql'] = component_dict['sql']
-                
-                # Check for table/data
-                if hasattr(actual_component, 'data') or hasattr(actual_component, 'rows'):
-                    data = getattr(actual_component, 'data', getattr(actual_component, 'rows', []))
-                    columns = getattr(actual_component, 'columns', [])
-                    if data:
-                        result['results'] = {
-                            'columns': columns if columns else [],
-                            'rows': data if isinstance(data, list) else [data],
-                            'count': len(data) if isinstance(data, list) else 1
-                        }
-                elif 'data' in component_dict:
-                    result['results'] = {
-                        'columns': component_dict.get('columns', []),
-                        'rows': component_dict.get('data', []),
-                        'count': len(component_dict.get('data', []))
-                    }
-                
-                # Fallback: try to convert component to string
-                if not result['response'] and not result['sql'] and not result['results']:
-                    component_str = str(actual_component)
-                    if component_str and component_str not in ['None', '']:
-                        result['response'] += component_str + '\n'
-                        
-            except Exception as e:
-                _logger.warning(f'Error processing component {component}: {str(e)}', exc_info=True)
-                # Try to add as string as fallback
-                try:
-                    result['response'] += str(component) + '\n'
-                except:
-                    pass
-        
-        # Clean up response
-        result['response'] = result['response'].strip()
-        
-        # If no response at all, add a default message
-        if not result['response'] and not result['sql'] and not result['results']:
-            result['response'] = 'I received your message but could not generate a response.'
-        
-        return result
-
     @api.model
     def get_model_info(self, model_name):
         """Get information about an Odoo model"""
         try:
-            model = self.env['ir.model'].search([
-                ('model', '=', model_name)
-            ], limit=1)
+            metadata = self._get_model_metadata(model_name, self.env.lang or 'en_US')
 
-            if not model:
+            if not metadata:
                 return {'error': f'Model {model_name} not found'}
 
-            fields = self.env['ir.model.fields'].search([
-                ('model_id', '=', model.id)
-            ])
-
+            model, name, info, fields = metadata
             field_info = [{
-                'name': f.name,
-                'description': f.field_description,
-                'type': f.ttype,
-                'required': f.required,
-            } for f in fields]
+                'name': field_name,
+                'description': description,
+                'type': ttype,
+                'required': required,
+            } for field_name, description, ttype, required in fields]
 
             return {
-                'name': model.name,
-                'model': model.model,
-                'info': model.info,
+                'name': name,
+                'model': model,
+                'info': info,
                 'fields': field_info
             }
 
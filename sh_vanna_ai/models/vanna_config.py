@@ -1,14 +1,169 @@
+import hashlib
 import os
 import subprocess
 import logging
 import threading
+import time
+import uuid
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
+from operator import itemgetter
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
-import json
+from .vanna_json import json_dumps
 
 _logger = logging.getLogger(__name__)
 
+# Model download tuning
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_STREAMS = 4
+DOWNLOAD_LOG_EVERY = 10 * 1024 * 1024
+# Seconds to wait for a connection or for the next bytes of a download
+DOWNLOAD_TIMEOUT = 60
+
+# LLM server startup wait, in seconds
+SERVER_START_TIMEOUT = 30
+SERVER_POLL_MIN_DELAY = 0.05
+SERVER_POLL_MAX_DELAY = 2
+
+
+def _run_setup_command(cmd, cwd=None):
+    """Run a setup command, discarding its output unless it fails"""
+    result = subprocess.run(
+        cmd,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    if result.returncode != 0:
+        _logger.error(f'Command failed: {" ".join(cmd)}\n{result.stderr}')
+        raise subprocess.CalledProcessError(result.returncode, cmd, stderr=result.stderr)
+
+
+class _DownloadProgress:
+    """Thread-safe download progress counter that logs every 10MB"""
+
+    def __init__(self, total_size):
+        self.total_size = total_size
+        self.downloaded = 0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            previous = self.downloaded
+            self.downloaded += size
+            downloaded = self.downloaded
+
+        if self.total_size > 0 and previous // DOWNLOAD_LOG_EVERY != downloaded // DOWNLOAD_LOG_EVERY:
+            progress = (downloaded / self.total_size) * 100
+            _logger.info(f'Download progress: {progress:.1f}%')
+
+
+def _file_sha256(path):
+    """Compute the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _advertised_sha256(response):
+    """
+    Get the SHA-256 a server advertises for a file, if any
+
+    Hugging Face sends the SHA-256 of LFS files as X-Linked-Etag on the
+    resolve response; other ETags are ignored unless they look like one.
+    """
+    for r in [*response.history, response]:
+        for header in ('x-linked-etag', 'etag'):
+            value = r.headers.get(header, '').strip('"')
+            if value.startswith('W/'):
+                continue
+            if len(value) == 64 and all(c in '0123456789abcdef' for c in value.lower()):
+                return value.lower()
+    return None
+
+
+def _download_stream(url, model_file):
+    """Download a file with a single streamed request, returning its SHA-256"""
+    response = requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+
+    digest = hashlib.sha256()
+    progress = _DownloadProgress(int(response.headers.get('content-length', 0)))
+    with open(model_file, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if chunk:
+                f.write(chunk)
+                digest.update(chunk)
+                progress.add(len(chunk))
+
+    return digest.hexdigest()
+
+
+def _download_range(url, fd, start, end, progress, stop):
+    """
+    Download bytes start..end (inclusive) of url into fd at the same offset
+
+    Gives up quietly at the next chunk once stop is set by a failed sibling.
+    """
+    response = requests.get(
+        url,
+        headers={'Range': f'bytes={start}-{end}'},
+        stream=True,
+        timeout=DOWNLOAD_TIMEOUT
+    )
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise Exception(f'Server ignored range request for bytes {start}-{end}')
+
+    offset = start
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        if stop.is_set():
+            response.close()
+            return
+        if chunk:
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+            progress.add(len(chunk))
+
+    if offset != end + 1:
+        raise Exception(f'Incomplete download for bytes {start}-{end}')
+
+
+def _download_ranges(url, model_file, total_size):
+    """Download a file with parallel HTTP range requests"""
+    part_size = -(-total_size // DOWNLOAD_STREAMS)
+    ranges = [
+        (start, min(start + part_size, total_size) - 1)
+        for start in range(0, total_size, part_size)
+    ]
+    progress = _DownloadProgress(total_size)
+    stop = threading.Event()
+
+    fd = os.open(model_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, total_size)
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(_download_range, url, fd, start, end, progress, stop)
+                for start, end in ranges
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # Stop the other ranges so the error surfaces without
+                # waiting for their downloads to finish
+                stop.set()
+                raise
+    finally:
+        os.close(fd)
+
+
 
 class VannaConfig(models.Model):
     _name = 'vanna.config'
@@ -135,8 +290,7 @@ class VannaConfig(models.Model):
                 _logger.info('llama.cpp directory exists, skipping clone. Updating repository...')
                 # Try to update the repository
                 try:
-                    subprocess.run(['git', 'pull'], cwd=llamacpp_path, check=True, 
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    _run_setup_command(['git', 'pull'], cwd=llamacpp_path)
                 except subprocess.CalledProcessError:
                     _logger.warning('Could not update repository, continuing with existing code')
             else:
@@ -145,24 +299,32 @@ class VannaConfig(models.Model):
                 import shutil
                 shutil.rmtree(llamacpp_path)
                 _logger.info('Cloning llama.cpp repository...')
-                subprocess.run([
+                _run_setup_command([
                     'git', 'clone',
                     'https://github.com/ggerganov/llama.cpp.git',
                     llamacpp_path
-                ], check=True)
+                ])
         else:
             _logger.info('Cloning llama.cpp repository...')
             # Clone repo
-            subprocess.run([
+            _run_setup_command([
                 'git', 'clone',
                 'https://github.com/ggerganov/llama.cpp.git',
                 llamacpp_path
-            ], check=True)
+            ])
 
-        # Build
+        # Build a release binary tuned for this CPU, using all cores
         _logger.info('Building llama.cpp...')
-        subprocess.run(['cmake', '-B', 'build'], cwd=llamacpp_path, check=True)
-        subprocess.run(['cmake', '--build', 'build', '--config', 'Release'], cwd=llamacpp_path, check=True)
+        _run_setup_command([
+            'cmake', '-B', 'build',
+            '-DCMAKE_BUILD_TYPE=Release',
+            '-DGGML_NATIVE=ON',
+        ], cwd=llamacpp_path)
+        _run_setup_command([
+            'cmake', '--build', 'build',
+            '--config', 'Release',
+            '-j', str(os.cpu_count() or 4),
+        ], cwd=llamacpp_path)
 
         # Check for server binary in possible locations
         for server_path in server_paths:
@@ -178,76 +340,97 @@ class VannaConfig(models.Model):
         os.makedirs(models_path, exist_ok=True)
 
         model_file = os.path.join(models_path, model_info['filename'])
+        part_file = f'{model_file}.part'
+        checksum_file = f'{model_file}.sha256'
 
         if os.path.exists(model_file):
-            _logger.info(f'Model already exists: {model_file}')
-            return model_file
+            if not os.path.exists(checksum_file):
+                _logger.info(f'Model already exists: {model_file}')
+                return model_file
+
+            with open(checksum_file) as f:
+                expected = f.read().strip()
+            if _file_sha256(model_file) == expected:
+                _logger.info(f'Model already exists and is verified: {model_file}')
+                return model_file
+
+            _logger.warning(f'Model checksum mismatch, downloading again: {model_file}')
+            os.remove(model_file)
 
         _logger.info(f'Downloading model from {model_info["url"]}...')
 
-        response = requests.get(model_info['url'], stream=True)
-        response.raise_for_status()
+        # Probe size and range support, following redirects to the final host.
+        # Some hosts (e.g. presigned S3/GCS URLs) only allow GET, in which
+        # case the file is downloaded with a single request
+        head = None
+        total_size = 0
+        expected = None
+        try:
+            head = requests.head(model_info['url'], allow_redirects=True, timeout=30)
+            head.raise_for_status()
+            total_size = int(head.headers.get('content-length', 0))
+            expected = _advertised_sha256(head)
+        except requests.RequestException as e:
+            _logger.warning(f'Could not probe model URL, downloading with a single request: {str(e)}')
+            head = None
+
+        # Download next to the final file and only rename it once complete
+        try:
+            if head is not None and total_size > 0 and head.headers.get('accept-ranges') == 'bytes':
+                _download_ranges(head.url, part_file, total_size)
+                digest = _file_sha256(part_file)
+            else:
+                digest = _download_stream(model_info['url'], part_file)
 
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
+            if expected and digest != expected:
+                raise Exception(f'Checksum mismatch for {model_info["filename"]}: expected {expected}, got {digest}')
+        except Exception:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            raise
 
-        with open(model_file, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        progress = (downloaded / total_size) * 100
-                        if downloaded % (10 * 1024 * 1024) == 0:  # Log every 10MB
-                            _logger.info(f'Download progress: {progress:.1f}%')
+        with open(checksum_file, 'w') as f:
+            f.write(digest)
+        os.replace(part_file, model_file)
 
         _logger.info(f'Model downloaded: {model_file}')
         return model_file
 
     def _start_llm_server(self):
         """Start llama.cpp server in background"""
+        log_path = os.path.join(self._get_base_path(), 'llama.log')
+
+        cmd = [
+            self.server_path,
+            '-m', self.model_path,
+            '--port', str(self.llm_port),
+            '-c', '2048',
+            '--threads', '4',
+        ]
 
-        def run_server():
-            try:
-                cmd = [
-                    self.server_path,
-                    '-m', self.model_path,
-                    '--port', str(self.llm_port),
-                    '-c', '2048',
-                    '--threads', '4',
-                ]
-
-                _logger.info(f'Starting LLM server: {" ".join(cmd)}')
-
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-
-                # Store process info
-                self.env['ir.config_parameter'].sudo().set_param(
-                    'vanna.llm_pid', str(process.pid)
-                )
-
-                # Monitor output
-                for line in process.stdout:
-                    if 'HTTP server listening' in line:
-                        _logger.info('LLM server ready')
-                        break
-
-            except Exception as e:
-                _logger.error(f'Server error: {str(e)}')
-                self.llm_status = 'error'
-                self.error_message = str(e)
+        _logger.info(f'Starting LLM server: {" ".join(cmd)}')
+
+        # Popen returns immediately, so the server is started from this thread.
+        # Server output goes to a log file, so there is no pipe to drain. The
+        # server gets its own session and none of Odoo's open file descriptors.
+        with open(log_path, 'ab', buffering=0) as log_file:
+            process = subprocess.Popen(
+                cmd,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+                close_fds=True
+            )
 
-        thread = threading.Thread(target=run_server, daemon=True)
-        thread.start()
+        # Store process info
+        self.env['ir.config_parameter'].sudo().set_param(
+            'vanna.llm_pid', str(process.pid)
+        )
 
-        # Wait for server to be ready
-        import time
-        for _ in range(30):
+        # Wait for server to be ready, backing off between health checks
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        delay = SERVER_POLL_MIN_DELAY
+        while True:
             try:
                 response = requests.get(f'http://localhost:{self.llm_port}/health', timeout=1)
                 if response.status_code == 200:
@@ -255,7 +438,16 @@ class VannaConfig(models.Model):
                     return
             except:
                 pass
-            time.sleep(1)
+
+            if process.poll() is not None:
+                raise Exception(f'LLM server exited with code {process.returncode}, see {log_path}')
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, SERVER_POLL_MAX_DELAY)
 
         _logger.warning('Could not confirm server health, but continuing...')
 
@@ -268,26 +460,45 @@ class VannaConfig(models.Model):
             # This will be used by the agent to understand the database structure
             schema_info = []
 
-            # Get all models
-            models = self.env['ir.model'].search([])
-            for model in models[:50]:  # Limit to avoid timeout
-                ddl = f"-- Table: {model.model.replace('.', '_')} ({model.name})\n"
-                fields = self.env['ir.model.fields'].search([('model_id', '=', model.id)])
-                for field in fields:
-                    ddl += f"-- Field: {field.name} ({field.field_description}), Type: {field.ttype}\n"
+            # Get the first 50 models with all their fields in one query
+            # (name and field_description are translated JSONB columns)
+            self.env.cr.execute("""
+                SELECT im.model,
+                       COALESCE(im.name->>%(lang)s, im.name->>'en_US'),
+                       imf.name,
+                       COALESCE(imf.field_description->>%(lang)s, imf.field_description->>'en_US'),
+                       imf.ttype
+                FROM (
+                    SELECT id, model, name FROM ir_model ORDER BY model LIMIT 50  -- Limit to avoid timeout
+                ) im
+                LEFT JOIN ir_model_fields imf ON imf.model_id = im.id
+                ORDER BY im.model, imf.name
+            """, {'lang': self.env.lang or 'en_US'})
+
+            for (model, model_name), rows in groupby(self.env.cr.fetchall(), key=itemgetter(0, 1)):
+                table = model.replace('.', '_')
+                ddl_parts = [f"-- Table: {table} ({model_name})\n"]
+                ddl_parts.extend(
+                    f"-- Field: {name} ({description}), Type: {ttype}\n"
+                    for _model, _model_name, name, description, ttype in rows
+                    if name
+                )
 
                 schema_info.append({
-                    'table': model.model.replace('.', '_'),
-                    'name': model.name,
-                    'ddl': ddl
+                    'table': table,
+                    'name': model_name,
+                    'ddl': ''.join(ddl_parts)
                 })
 
             # Store schema information as JSON
-            import json
-            schema_json = json.dumps(schema_info)
+            schema_json = json_dumps(schema_info).decode()
             self.env['ir.config_parameter'].sudo().set_param(
                 'vanna.schema_info', schema_json
             )
+            # New version token lets the chatbot reuse its parsed schema cache
+            self.env['ir.config_parameter'].sudo().set_param(
+                'vanna.schema_version', str(uuid.uuid4())
+            )
 
             # Mark as trained
             self.env['ir.config_parameter'].sudo().set_param(
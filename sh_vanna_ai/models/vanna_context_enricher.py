@@ -0,0 +1,30 @@
+"""
+ToolContext enricher that exposes the current Odoo environment to tools
+"""
+from contextvars import ContextVar
+from vanna.core.enricher import ToolContextEnricher
+from vanna.core.tool import ToolContext
+
+# Odoo environment of the request currently being processed. It is set by
+# the coroutine that drives Agent.send_message, so every task spawned for
+# that request sees its own env and nothing is stored on shared objects.
+current_odoo_env = ContextVar('current_odoo_env', default=None)
+
+
+class OdooEnvContextEnricher(ToolContextEnricher):
+    """Enricher that adds the request's Odoo env to the tool context metadata"""
+
+    async def enrich_context(self, context: ToolContext) -> ToolContext:
+        """
+        Add the current Odoo environment to the tool context
+
+        Args:
+            context: Tool context to enrich
+
+        Returns:
+            Tool context with 'odoo_env' in metadata
+        """
+        env = current_odoo_env.get()
+        if env is not None:
+            context.metadata['odoo_env'] = env
+        return context
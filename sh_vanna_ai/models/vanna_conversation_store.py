@@ -0,0 +1,37 @@
+"""
+Simple ConversationStore implementation for Odoo integration with Vanna 2.0
+This is a no-op implementation that doesn't keep conversation history
+"""
+from typing import List, Optional
+from vanna.core.storage import ConversationStore, Conversation
+from vanna.core.user import User
+
+
+class NoOpConversationStore(ConversationStore):
+    """No-op ConversationStore that doesn't store anything"""
+
+    async def create_conversation(
+        self, conversation_id: str, user: User, initial_message: str
+    ) -> Conversation:
+        """Create a new conversation (not stored)"""
+        return Conversation(id=conversation_id, user=user, messages=[])
+
+    async def get_conversation(
+        self, conversation_id: str, user: User
+    ) -> Optional[Conversation]:
+        """Get conversation by ID (returns None)"""
+        return None
+
+    async def update_conversation(self, conversation: Conversation) -> None:
+        """Update conversation with new messages (no-op)"""
+        pass
+
+    async def delete_conversation(self, conversation_id: str, user: User) -> bool:
+        """Delete conversation (no-op)"""
+        return False
+
+    async def list_conversations(
+        self, user: User, limit: int = 50, offset: int = 0
+    ) -> List[Conversation]:
+        """List conversations for user (returns empty)"""
+        return []
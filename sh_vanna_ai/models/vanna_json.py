@@ -0,0 +1,23 @@
+"""
+JSON helpers using orjson when it is installed
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, see requirements.txt
+    orjson = None
+
+
+def json_dumps(obj) -> bytes:
+    """Serialize obj to JSON bytes, using orjson when available"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def json_loads(data):
+    """Parse JSON from str or bytes, using orjson when available"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -3,18 +3,213 @@ Custom LLM Service for Vanna 2.0 that integrates with local llama.cpp server
 """
 import logging
 import asyncio
+import atexit
+import copy
+import hashlib
+import json
+import os
+import threading
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional, List, Dict, Any, AsyncIterator
-from vanna.core.llm import LlmService
+from vanna.core.llm import LlmService, LlmRequest
 from vanna.core.llm.base import LlmStreamChunk
 
+from .vanna_cache import TTLCache
+from .vanna_json import json_dumps, json_loads
+
 _logger = logging.getLogger(__name__)
 
+# Prompt line prefix for each message role
+_ROLE_PREFIX = {
+    'system': 'System: ',
+    'user': 'Human: ',
+    'assistant': 'Assistant: ',
+}
+
+
+def _from_dict(msg):
+    """Extract (role, content) from a message dict"""
+    return msg.get('role', 'user'), msg.get('content', '')
+
+
+def _from_tuple(msg):
+    """Extract (role, content) from a (role, content, ...) or (content,) tuple"""
+    if len(msg) >= 2:
+        return msg[0], msg[1]
+    if msg:
+        # Single element tuple, treat as content
+        return 'user', msg[0]
+    return 'user', str(msg)
+
+
+def _from_other(msg):
+    """Extract (role, content) from dict/tuple subclasses or any other value"""
+    if isinstance(msg, dict):
+        return _from_dict(msg)
+    if isinstance(msg, tuple):
+        return _from_tuple(msg)
+    # Fallback: treat as string content
+    return 'user', str(msg)
+
+
+# Message format dispatch on the exact message type
+_EXTRACT = {
+    dict: _from_dict,
+    tuple: _from_tuple,
+}
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Status codes telling that the server has no chat completion endpoint
+_MISSING_ENDPOINT_STATUS = frozenset({404, 405, 501})
+
+
+def _completion_content(data) -> str:
+    """Extract the generated text from a /completion response"""
+    return data.get('content', '')
+
+
+def _chat_content(data) -> str:
+    """Extract the generated text from a /v1/chat/completions response"""
+    choices = data.get('choices')
+    if not choices:
+        return ''
+    return choices[0].get('message', {}).get('content') or ''
+
+
+def _completion_delta(data) -> tuple:
+    """Extract (token, done) from a /completion stream event"""
+    return data.get('content'), bool(data.get('stop'))
+
+
+def _chat_delta(data) -> tuple:
+    """Extract (token, done) from a /v1/chat/completions stream event"""
+    choices = data.get('choices')
+    if not choices:
+        return None, False
+    choice = choices[0]
+    return choice.get('delta', {}).get('content'), choice.get('finish_reason') is not None
+
+
+class LlmStreamError(Exception):
+    """Error reported by the llama.cpp server in the middle of a stream"""
+
+
+def _stream_error(error) -> LlmStreamError:
+    """
+    Build the exception for an error reported in a stream
+
+    Args:
+        error: Payload of an 'error:' event or the 'error' key of a data event
+
+    Returns:
+        LlmStreamError carrying the server's message
+    """
+    if isinstance(error, dict):
+        error = error.get('message') or error
+    return LlmStreamError(f'LLM server error: {error}')
+
+
+def _build_session() -> requests.Session:
+    """
+    Build an HTTP session with a keep-alive connection pool for llama.cpp
+
+    Returns:
+        Configured requests session
+    """
+    session = requests.Session()
+    # llama.cpp answers 503 while the model is still loading, so POST is
+    # retried on failed connects and on those statuses. A read timeout means
+    # the server is still generating: retrying would repeat that work and
+    # multiply the wait, so reads are never retried
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=2,
+            read=0,
+            backoff_factor=0.1,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset({'POST'}),
+            raise_on_status=False,
+        ),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# HTTP clients shared by every service instance of a process, keyed by pid
+# since Odoo may fork workers after the module is imported
+_SHARED_SESSION = {}
+_SHARED_ASYNC = {}
+_shared_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """
+    Get the HTTP session shared by the current process
+
+    Returns:
+        requests session reusing connections to the LLM server
+    """
+    pid = os.getpid()
+    session = _SHARED_SESSION.get(pid)
+    if session is None:
+        with _shared_lock:
+            session = _SHARED_SESSION.get(pid)
+            if session is None:
+                session = _SHARED_SESSION[pid] = _build_session()
+    return session
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """
+    Get the async HTTP client shared by the current process
+
+    Returns:
+        httpx client reusing connections to the LLM server
+    """
+    pid = os.getpid()
+    client = _SHARED_ASYNC.get(pid)
+    if client is None:
+        with _shared_lock:
+            client = _SHARED_ASYNC.get(pid)
+            if client is None:
+                client = _SHARED_ASYNC[pid] = httpx.AsyncClient(
+                    timeout=None,
+                    limits=httpx.Limits(max_keepalive_connections=16)
+                )
+    return client
+
+
+@atexit.register
+def _close_shared_sessions():
+    """Close the pooled connections of this process's session on exit"""
+    session = _SHARED_SESSION.pop(os.getpid(), None)
+    if session is not None:
+        session.close()
+
 
 class LocalLlamaCppLlmService(LlmService):
     """LLM Service adapter for local llama.cpp server"""
     
-    def __init__(self, llm_url: str = "http://localhost:8080/completion", temperature: float = 0.1, max_tokens: int = 500):
+    # Stop sequences used when the caller passes none
+    _DEFAULT_STOP = ('\n\n', 'Human:', 'Assistant:')
+    
+    def __init__(
+        self,
+        llm_url: str = "http://localhost:8080/completion",
+        temperature: float = 0.1,
+        max_tokens: int = 500,
+        cache_max_temperature: float = 0.0,
+        cache_size: int = 512,
+        cache_ttl: float = 300.0,
+        chat_url: Optional[str] = None
+    ):
         """
         Initialize the local LLM service
         
@@ -22,6 +217,17 @@ class LocalLlamaCppLlmService(LlmService):
             llm_url: URL to the llama.cpp server completion endpoint
             temperature: Temperature for LLM generation
             max_tokens: Maximum tokens to generate
+            cache_max_temperature: Requests at or below this temperature
+                are answered from the response cache when an identical
+                request (same endpoint and body) was completed within
+                cache_ttl. Applies to send_request and stream_request; the
+                default of 0 only caches greedy decoding
+            cache_size: Maximum number of cached responses
+            cache_ttl: Seconds a cached response stays valid
+            chat_url: Optional URL to the llama.cpp chat completion endpoint
+                (/v1/chat/completions). When set, messages are sent as is and
+                the server applies the model's chat template; the prompt
+                endpoint is used if the server does not provide it
         """
         # Initialize parent class without arguments
         super().__init__()
@@ -29,7 +235,52 @@ class LocalLlamaCppLlmService(LlmService):
         self.llm_url = llm_url
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.chat_url = chat_url
+        self._chat_supported = True
+
+        # Exact-match response cache for deterministic requests
+        self.cache_max_temperature = cache_max_temperature
+        self._cache = TTLCache(cache_size, cache_ttl)
+        self.cache_stats = self._cache.stats
     
+    def _cache_key(self, url: str, payload: Dict[str, Any]) -> str:
+        """
+        Compute the response cache key for a request body
+
+        Args:
+            url: Endpoint the request is sent to
+            payload: llama.cpp request body
+
+        Returns:
+            Hex digest identifying the request
+        """
+        key = json.dumps({'url': url, 'payload': payload}, sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached response
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Deep copy of the cached response, or None if missing or expired
+        """
+        cached = self._cache.get(key)
+        return copy.deepcopy(cached) if cached is not None else None
+
+    def _cache_put(self, key: str, response: Dict[str, Any]):
+        """
+        Store a response in the cache, evicting the least recently used one
+
+        Args:
+            key: Cache key
+            response: Response dictionary, copied so later changes by the
+                caller do not reach the cache
+        """
+        self._cache.put(key, copy.deepcopy(response))
+
     def generate_response(
         self,
         messages,
@@ -62,39 +313,20 @@ class LocalLlamaCppLlmService(LlmService):
             Formatted prompt string
         """
         prompt_parts = []
+        append = prompt_parts.append
         
         if system:
-            prompt_parts.append(f"System: {system}\n")
+            append(f"System: {system}")
+        
+        extract = _EXTRACT.get
         
         for msg in messages:
             # Handle both dict and tuple formats
-            if isinstance(msg, dict):
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-            elif isinstance(msg, tuple) and len(msg) >= 2:
-                # Tuple format: (role, content) or (role, content, ...)
-                role = msg[0]
-                content = msg[1]
-            elif isinstance(msg, tuple) and len(msg) == 1:
-                # Single element tuple, treat as content
-                role = 'user'
-                content = msg[0]
-            else:
-                # Fallback: treat as string content
-                role = 'user'
-                content = str(msg)
-            
-            if role == 'system':
-                prompt_parts.append(f"System: {content}\n")
-            elif role == 'user':
-                prompt_parts.append(f"Human: {content}\n")
-            elif role == 'assistant':
-                prompt_parts.append(f"Assistant: {content}\n")
-            else:
-                # Unknown role, default to user
-                prompt_parts.append(f"Human: {content}\n")
-        
-        prompt_parts.append("Assistant:")
+            role, content = extract(type(msg), _from_other)(msg)
+            # Unknown roles default to user
+            append(f"{_ROLE_PREFIX.get(role, 'Human: ')}{content}")
+        
+        append("Assistant:")
         
         return '\n'.join(prompt_parts)
     
@@ -120,6 +352,132 @@ class LocalLlamaCppLlmService(LlmService):
         
         return self.generate_response(messages, system=system, **kwargs)
     
+    def _completion_payload(self, messages, system: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Build the llama.cpp /completion request body
+
+        Args:
+            messages: List of message dicts or tuples with 'role' and 'content'
+            system: Optional system message
+            **kwargs: Additional parameters
+
+        Returns:
+            Request body dictionary
+        """
+        return {
+            # Convert messages to a prompt format for llama.cpp
+            'prompt': self._messages_to_prompt(messages, system),
+            'temperature': kwargs.get('temperature', self.temperature),
+            'max_tokens': kwargs.get('max_tokens', self.max_tokens),
+            'stop': kwargs.get('stop', self._DEFAULT_STOP),
+        }
+
+    def _coerce_messages(self, messages, system: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Convert messages to the chat completion messages array
+        
+        Args:
+            messages: List of message dicts or tuples (role, content)
+            system: Optional system message
+            
+        Returns:
+            List of dicts with 'role' and 'content'
+        """
+        coerced = []
+        append = coerced.append
+        extract = _EXTRACT.get
+        
+        if system:
+            append({'role': 'system', 'content': system})
+        
+        for msg in messages:
+            role, content = extract(type(msg), _from_other)(msg)
+            # Unknown roles default to user
+            if role not in _ROLE_PREFIX:
+                role = 'user'
+            append({'role': role, 'content': str(content)})
+        
+        return coerced
+    
+    def _chat_payload(self, messages, system: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Build the llama.cpp /v1/chat/completions request body
+
+        Args:
+            messages: List of message dicts or tuples with 'role' and 'content'
+            system: Optional system message
+            **kwargs: Additional parameters
+
+        Returns:
+            Request body dictionary
+        """
+        payload = {
+            'model': 'local',
+            'messages': self._coerce_messages(messages, system),
+            'temperature': kwargs.get('temperature', self.temperature),
+            'max_tokens': kwargs.get('max_tokens', self.max_tokens),
+        }
+        # The server's chat template ends turns by itself; _DEFAULT_STOP only
+        # fits the hand-built prompt and would cut multi-paragraph answers
+        if 'stop' in kwargs:
+            payload['stop'] = kwargs['stop']
+        return payload
+
+    def _use_chat(self) -> bool:
+        """Tell whether requests go to the chat completion endpoint"""
+        return bool(self.chat_url) and self._chat_supported
+
+    def _disable_chat(self, error: Exception):
+        """
+        Fall back to the prompt endpoint after the server rejected the chat one
+
+        Args:
+            error: Error returned by the chat completion endpoint
+        """
+        self._chat_supported = False
+        _logger.warning(f'LLM chat endpoint unavailable, using prompt completion: {str(error)}')
+
+    def _post(self, url: str, payload: Dict[str, Any], extract, **kwargs) -> Dict[str, Any]:
+        """
+        Post a request body to the llama.cpp server
+
+        Args:
+            url: Endpoint to call
+            payload: Request body
+            extract: Function returning the generated text of a response
+            **kwargs: Additional parameters
+
+        Returns:
+            Response dictionary
+        """
+        # Deterministic requests are answered from the cache when possible
+        cache_key = None
+        if payload['temperature'] <= self.cache_max_temperature:
+            cache_key = self._cache_key(url, payload)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+        # Call llama.cpp server
+        response = _get_session().post(
+            url,
+            data=json_dumps(payload),
+            headers=_JSON_HEADERS,
+            timeout=kwargs.get('timeout', 30)
+        )
+        response.raise_for_status()
+        
+        data = json_loads(response.content)
+        
+        # llama.cpp returns the completion as a single string
+        result = {
+            'content': extract(data).strip(),
+            'raw': data
+        }
+        if cache_key:
+            self._cache_put(cache_key, result)
+        return result
+
     def send_request(
         self,
         messages,
@@ -138,38 +496,52 @@ class LocalLlamaCppLlmService(LlmService):
             Response dictionary
         """
         try:
-            # Convert messages to a prompt format for llama.cpp
-            prompt = self._messages_to_prompt(messages, system)
-            
-            # Call llama.cpp server
-            response = requests.post(
+            if self._use_chat():
+                try:
+                    return self._post(
+                        self.chat_url,
+                        self._chat_payload(messages, system, **kwargs),
+                        _chat_content,
+                        **kwargs
+                    )
+                except requests.HTTPError as e:
+                    if e.response is None or e.response.status_code not in _MISSING_ENDPOINT_STATUS:
+                        raise
+                    self._disable_chat(e)
+
+            return self._post(
                 self.llm_url,
-                json={
-                    'prompt': prompt,
-                    'temperature': kwargs.get('temperature', self.temperature),
-                    'max_tokens': kwargs.get('max_tokens', self.max_tokens),
-                    'stop': kwargs.get('stop', ['\n\n', 'Human:', 'Assistant:']),
-                },
-                timeout=kwargs.get('timeout', 30)
+                self._completion_payload(messages, system, **kwargs),
+                _completion_content,
+                **kwargs
             )
-            response.raise_for_status()
-            
-            data = response.json()
-            content = data.get('content', '')
-            
-            # Clean up the response
-            if isinstance(content, list):
-                content = ''.join(content)
-            
-            return {
-                'content': content.strip(),
-                'raw': data
-            }
             
         except Exception as e:
             _logger.error(f'LLM service error: {str(e)}')
             raise
     
+    def _unpack_request(self, request: LlmRequest, kwargs: Dict[str, Any]) -> tuple:
+        """
+        Split a Vanna LlmRequest into messages, system prompt and parameters
+        
+        Args:
+            request: Request built by the Vanna agent
+            kwargs: Additional parameters given alongside the request
+            
+        Returns:
+            Tuple of (messages, system, kwargs) with message dicts having
+            'role' and 'content' and the request's sampling parameters
+        """
+        messages = [
+            {'role': message.role, 'content': message.content}
+            for message in request.messages
+        ]
+        kwargs = dict(kwargs)
+        kwargs.setdefault('temperature', request.temperature)
+        if request.max_tokens:
+            kwargs.setdefault('max_tokens', request.max_tokens)
+        return messages, request.system_prompt, kwargs
+
     async def stream_request(
         self,
         messages,
@@ -180,51 +552,220 @@ class LocalLlamaCppLlmService(LlmService):
         Stream a request to the LLM and yield response chunks as async generator
         
         Args:
-            messages: List of message dicts or tuples with 'role' and 'content'
-            system: Optional system message
+            messages: LlmRequest from the Vanna agent, or list of message
+                dicts or tuples with 'role' and 'content'
+            system: Optional system message, taken from the request's
+                system prompt when an LlmRequest is given
             **kwargs: Additional parameters
             
         Yields:
             LlmStreamChunk objects with content
         """
-        # For llama.cpp, we'll use the non-streaming endpoint
-        # and yield the complete response as chunks
-        # In a full implementation, you could use SSE or streaming endpoints
+        # The Vanna agent passes its LlmRequest as the only argument
+        if isinstance(messages, LlmRequest):
+            messages, system, kwargs = self._unpack_request(messages, kwargs)
+        
         try:
-            # Run the blocking send_request in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.send_request(messages, system, **kwargs)
-            )
-            content = response.get('content', '')
-            
-            # Yield the content in chunks (simulate streaming)
-            # In a real streaming implementation, you'd yield as data arrives
-            if content:
-                # Split into chunks for streaming effect
-                chunk_size = 50
-                for i in range(0, len(content), chunk_size):
-                    # Yield with a small async delay to make it properly async
-                    await asyncio.sleep(0)
-                    # Create LlmStreamChunk object with content
+            received = False
+            try:
+                async for chunk in self._stream_completion(messages, system, **kwargs):
+                    received = True
+                    yield chunk
+                return
+            except (httpx.HTTPError, LlmStreamError) as e:
+                # Nothing was sent to the caller yet, so retry without streaming
+                if received:
+                    raise
+                _logger.warning(f'LLM streaming failed, falling back to a blocking request: {str(e)}')
+
+            async for chunk in self._stream_fallback(messages, system, **kwargs):
+                yield chunk
+        except Exception as e:
+            _logger.error(f'LLM streaming error: {str(e)}')
+            raise
+
+    async def _stream_completion(
+        self,
+        messages,
+        system: Optional[str] = None,
+        **kwargs
+    ) -> AsyncIterator[LlmStreamChunk]:
+        """
+        Stream tokens from the llama.cpp server as they are generated
+
+        Uses the chat completion endpoint when configured and available,
+        the prompt completion endpoint otherwise.
+
+        Args:
+            messages: List of message dicts or tuples with 'role' and 'content'
+            system: Optional system message
+            **kwargs: Additional parameters
+
+        Yields:
+            LlmStreamChunk objects with content
+        """
+        if self._use_chat():
+            try:
+                # The status is checked before the first event, so nothing
+                # has been yielded when the endpoint turns out to be missing
+                async for chunk in self._stream_events(
+                    self.chat_url,
+                    self._chat_payload(messages, system, **kwargs),
+                    _chat_delta,
+                    **kwargs
+                ):
+                    yield chunk
+                return
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in _MISSING_ENDPOINT_STATUS:
+                    raise
+                self._disable_chat(e)
+
+        async for chunk in self._stream_events(
+            self.llm_url,
+            self._completion_payload(messages, system, **kwargs),
+            _completion_delta,
+            **kwargs
+        ):
+            yield chunk
+
+    async def _stream_events(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        extract,
+        **kwargs
+    ) -> AsyncIterator[LlmStreamChunk]:
+        """
+        Stream tokens of one llama.cpp endpoint
+
+        llama.cpp sends server-sent events: one 'data: {...}' line per token,
+        the last one marking the end of generation. The OpenAI compatible
+        endpoint may also close the stream with 'data: [DONE]'. A failure
+        during generation arrives as an 'error: {...}' line (or a data event
+        with an 'error' key) before the stream is closed.
+
+        Args:
+            url: Endpoint to call
+            payload: Request body, without the 'stream' flag
+            extract: Function returning (token, done) for an event
+            **kwargs: Additional parameters
+
+        Yields:
+            LlmStreamChunk objects with content
+        """
+        payload['stream'] = True
+
+        # Deterministic requests replay a previously completed stream
+        cache_key = None
+        if payload['temperature'] <= self.cache_max_temperature:
+            cache_key = self._cache_key(url, payload)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                if cached['content']:
                     yield LlmStreamChunk(
-                        content=content[i:i + chunk_size],
+                        content=cached['content'],
                         tool_calls=None,
                         finish_reason=None,
                         metadata={}
                     )
-            
-            # Yield final chunk with finish_reason
+                yield LlmStreamChunk(
+                    content=None,
+                    tool_calls=None,
+                    finish_reason='stop',
+                    metadata={}
+                )
+                return
+
+        tokens = []
+        finished = False
+        async with _get_async_client().stream(
+            'POST',
+            url,
+            content=json_dumps(payload),
+            headers=_JSON_HEADERS,
+            timeout=kwargs.get('timeout', 30)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith('error: '):
+                    try:
+                        error = json_loads(line[7:])
+                    except ValueError:
+                        error = line[7:]
+                    raise _stream_error(error)
+                if not line.startswith('data: '):
+                    continue
+                if line == 'data: [DONE]':
+                    break
+                data = json_loads(line[6:])
+                if 'error' in data:
+                    raise _stream_error(data['error'])
+                content, done = extract(data)
+                if content:
+                    tokens.append(content)
+                    yield LlmStreamChunk(
+                        content=content,
+                        tool_calls=None,
+                        finish_reason=None,
+                        metadata={}
+                    )
+                if done:
+                    finished = True
+                    break
+
+        # A stream that ends without a stop/finish event was cut short, so
+        # it is neither reported as complete nor cached
+        if not finished:
+            raise LlmStreamError('LLM stream ended before generation finished')
+        if cache_key:
+            self._cache_put(cache_key, {'content': ''.join(tokens)})
+
+        # Yield final chunk with finish_reason
+        yield LlmStreamChunk(
+            content=None,
+            tool_calls=None,
+            finish_reason='stop',
+            metadata={}
+        )
+
+    async def _stream_fallback(
+        self,
+        messages,
+        system: Optional[str] = None,
+        **kwargs
+    ) -> AsyncIterator[LlmStreamChunk]:
+        """
+        Stream a completed non-streaming response
+
+        Args:
+            messages: List of message dicts or tuples with 'role' and 'content'
+            system: Optional system message
+            **kwargs: Additional parameters
+
+        Yields:
+            LlmStreamChunk objects with content
+        """
+        # Run the blocking send_request in a thread pool to avoid blocking
+        response = await asyncio.to_thread(self.send_request, messages, system, **kwargs)
+        content = response.get('content', '')
+
+        # The response is already complete, so yield it as a single chunk
+        if content:
             yield LlmStreamChunk(
-                content=None,
+                content=content,
                 tool_calls=None,
-                finish_reason='stop',
+                finish_reason=None,
                 metadata={}
             )
-        except Exception as e:
-            _logger.error(f'LLM streaming error: {str(e)}')
-            raise
+
+        # Yield final chunk with finish_reason
+        yield LlmStreamChunk(
+            content=None,
+            tool_calls=None,
+            finish_reason='stop',
+            metadata={}
+        )
     
     def validate_tools(self, tools: List[Any]) -> bool:
         """
@@ -1,32 +1,91 @@
 """
 Custom SQL Tool for Vanna 2.0 that integrates with Odoo database
 """
+import asyncio
 import logging
-from typing import Type, Optional
+import re
+import uuid
+from typing import Type
+import sqlparse
+from sqlparse.tokens import DML, Keyword
 from pydantic import BaseModel, Field
 from vanna.core.tool import Tool, ToolContext, ToolResult
 from odoo.exceptions import UserError
+from odoo.sql_db import db_connect
 
 _logger = logging.getLogger(__name__)
 
+# Statements that must never reach the database, matched as whole words on
+# the raw SQL text. The scan deliberately ignores SQL syntax: a tokenizer's
+# idea of string literals and comments may differ from PostgreSQL's (e.g.
+# backslash escapes), so a keyword anywhere rejects the query, even inside a
+# literal. Identifiers such as ``execution_time`` or ``last_update`` pass.
+_FORBIDDEN_SQL_RE = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE|GRANT|REVOKE|'
+    r'EXEC|EXECUTE|CALL|MERGE|COPY)\b',
+    re.IGNORECASE,
+)
+
+# Number of result rows shown to the LLM
+DISPLAY_ROWS = 10
+# Rows per round trip when the server-side cursor is iterated
+CURSOR_ITERSIZE = 200
+# Seconds a query may run; the worker thread is not cancelled when the agent
+# times out, so the database has to stop it
+STATEMENT_TIMEOUT = 30
+
+
+def _render_row(row) -> str:
+    """Render one result row as a ``|`` separated line"""
+    return " | ".join("NULL" if val is None else str(val) for val in row)
+
+
+def _fetch_rows(dbname: str, sql: str, params: tuple = None) -> tuple:
+    """
+    Run a validated SELECT on a dedicated connection and fetch the rows to display
+
+    Runs in a worker thread: the request's ``env.cr`` is not thread-safe, so
+    a separate cursor is taken from Odoo's read-only connection pool. That
+    pool only routes the query (e.g. to a replica when configured); it is no
+    protection against injected statements, which _validate_sql must stop.
+    The query runs on a named (server-side) cursor, so only the displayed
+    rows plus one are transferred no matter how large the result is, and is
+    bounded by STATEMENT_TIMEOUT since nothing cancels it from outside.
+
+    Args:
+        dbname: Name of the Odoo database
+        sql: SQL SELECT query, already validated
+        params: Query parameters, or None when the query has no placeholders
+
+    Returns:
+        Tuple of (columns, rows) with at most DISPLAY_ROWS + 1 rows
+    """
+    with db_connect(dbname, readonly=True).cursor() as db_cr:
+        db_cr.execute("SET LOCAL statement_timeout = %s", (STATEMENT_TIMEOUT * 1000,))
+        cr = db_cr._cnx.cursor(name=f'vanna_sql_{uuid.uuid4().hex}')
+        try:
+            cr.itersize = CURSOR_ITERSIZE
+            cr.execute(sql, params)
+            rows = cr.fetchmany(DISPLAY_ROWS + 1)
+            columns = [desc[0] for desc in cr.description] if cr.description else []
+        finally:
+            cr.close()
+    return columns, rows
+
 
 class RunSqlArgs(BaseModel):
     """Arguments for running SQL queries"""
     sql: str = Field(description="The SQL SELECT query to execute")
-    limit: Optional[int] = Field(default=100, description="Maximum number of rows to return")
+    limit: int = Field(default=100, ge=1, le=10000, description="Maximum number of rows to return")
 
 
 class OdooSqlTool(Tool[RunSqlArgs]):
-    """SQL Tool that executes queries on Odoo database with safety checks"""
-    
-    def __init__(self, env=None):
-        """
-        Initialize the SQL tool
-        
-        Args:
-            env: Odoo environment (will be set via context)
-        """
-        self.env = env
+    """
+    SQL Tool that executes queries on Odoo database with safety checks
+
+    The tool holds no Odoo environment so it can be shared by cached agents;
+    the request's env is read from the tool context metadata.
+    """
     
     @property
     def name(self) -> str:
@@ -50,25 +109,24 @@ class OdooSqlTool(Tool[RunSqlArgs]):
         Execute SQL query with safety checks
         
         Args:
-            context: Tool context (contains user info)
+            context: Tool context (contains user info and Odoo env in metadata)
             args: SQL query arguments
             
         Returns:
             ToolResult with query results
         """
         try:
-            # Get Odoo environment - prefer stored one, fallback to context
-            env = self.env
-            if not env and hasattr(context, 'env'):
-                env = context.env
+            # Get Odoo environment of the current request from the tool context
+            env = context.metadata.get('odoo_env')
             
-            if not env:
+            if env is None:
                 return ToolResult(
                     success=False,
                     result_for_llm="Odoo environment not available"
                 )
             
-            sql = args.sql.strip()
+            # A trailing semicolon would end the statement before the added LIMIT
+            sql = args.sql.strip().rstrip(';').rstrip()
             
             # Safety validation
             validation_result = self._validate_sql(sql)
@@ -78,23 +136,26 @@ class OdooSqlTool(Tool[RunSqlArgs]):
                     result_for_llm=validation_result['error']
                 )
             
-            # Add LIMIT if not present
-            sql_upper = sql.upper()
-            if 'LIMIT' not in sql_upper:
-                sql = f"{sql} LIMIT {args.limit}"
-            
-            # Execute query
-            env.cr.execute(sql)
+            # Add LIMIT if not present, passed as a parameter rather than
+            # formatted into the query; literal % must then be escaped
+            params = None
+            if not validation_result['has_limit']:
+                # On its own line so a trailing -- comment cannot swallow it
+                sql = sql.replace('%', '%%') + "\nLIMIT %s"
+                params = (args.limit,)
             
-            # Fetch results
-            columns = [desc[0] for desc in env.cr.description] if env.cr.description else []
-            rows = env.cr.fetchall()
+            # Execute query off the event loop so concurrent tool calls and
+            # the LLM stream are not blocked by the database round trip
+            columns, rows = await asyncio.to_thread(_fetch_rows, env.cr.dbname, sql, params)
             
             # Format results
+            has_more = len(rows) > DISPLAY_ROWS
+            rows = rows[:DISPLAY_ROWS]
             result_data = {
                 'columns': columns,
                 'rows': rows,
-                'count': len(rows)
+                'count': len(rows),
+                'has_more': has_more,
             }
             
             # Format for LLM
@@ -121,39 +182,61 @@ class OdooSqlTool(Tool[RunSqlArgs]):
             sql: SQL query string
             
         Returns:
-            Dict with 'valid' boolean and optional 'error' message
+            Dict with 'valid' boolean, optional 'error' message and, for
+            valid queries, 'has_limit' telling whether the statement
+            already carries a top-level LIMIT clause
         """
-        sql_upper = sql.upper().strip()
+        # Check for dangerous keywords on the raw text, see _FORBIDDEN_SQL_RE
+        match = _FORBIDDEN_SQL_RE.search(sql)
+        if match:
+            return {
+                'valid': False,
+                'error': f'SQL contains forbidden keyword: {match.group(1).upper()}. Only SELECT queries are allowed.'
+            }
         
-        # Check for dangerous keywords
-        dangerous_keywords = [
-            'INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE',
-            'ALTER', 'TRUNCATE', 'GRANT', 'REVOKE', 'EXEC',
-            'EXECUTE', 'CALL', 'MERGE', 'COPY'
-        ]
+        # No statement separator may remain once the trailing one is stripped,
+        # wherever sqlparse thinks it is
+        if ';' in sql:
+            return {
+                'valid': False,
+                'error': 'Exactly one SELECT statement is allowed.'
+            }
         
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                return {
-                    'valid': False,
-                    'error': f'SQL contains forbidden keyword: {keyword}. Only SELECT queries are allowed.'
-                }
+        # sqlparse is only trusted for the structure of the statement
+        statements = [
+            stmt for stmt in sqlparse.parse(sql)
+            if stmt.token_first(skip_cm=True) is not None
+        ]
+        if len(statements) != 1:
+            return {
+                'valid': False,
+                'error': 'Exactly one SELECT statement is allowed.'
+            }
+        stmt = statements[0]
         
         # Must start with SELECT
-        if not sql_upper.startswith('SELECT'):
+        first = stmt.token_first(skip_cm=True)
+        if first.ttype is not DML or first.normalized != 'SELECT':
             return {
                 'valid': False,
                 'error': 'Only SELECT queries are allowed. Query must start with SELECT.'
             }
         
-        return {'valid': True}
+        # A LIMIT inside a subquery is grouped in its parenthesis, so only
+        # top-level tokens say whether the whole result is bounded
+        has_limit = any(
+            token.ttype is Keyword and token.normalized == 'LIMIT'
+            for token in stmt.tokens
+        )
+        
+        return {'valid': True, 'has_limit': has_limit}
     
     def _format_results_for_llm(self, results: dict) -> str:
         """
         Format query results for LLM consumption
         
         Args:
-            results: Dict with 'columns', 'rows', and 'count'
+            results: Dict with 'columns', 'rows', 'count' and 'has_more'
             
         Returns:
             Formatted string
@@ -166,22 +249,20 @@ class OdooSqlTool(Tool[RunSqlArgs]):
         count = results['count']
         
         # Format as a simple table representation
-        lines = [f"Found {count} result(s):"]
+        if results.get('has_more'):
+            lines = [f"Showing the first {count} result(s), more are available:"]
+        else:
+            lines = [f"Found {count} result(s):"]
         lines.append("")
         
         # Show column headers
         if columns:
-            lines.append(" | ".join(columns))
-            lines.append("-" * (len(" | ".join(columns))))
-        
-        # Show rows (limit to 10 for LLM)
-        display_rows = rows[:10]
-        for row in display_rows:
-            row_str = " | ".join(str(val) if val is not None else "NULL" for val in row)
-            lines.append(row_str)
+            header = " | ".join(columns)
+            lines.append(header)
+            lines.append("-" * len(header))
         
-        if count > 10:
-            lines.append(f"... and {count - 10} more results")
+        # Show rows, already capped to DISPLAY_ROWS by the caller
+        lines.extend(map(_render_row, rows))
         
         return "\n".join(lines)
 
@@ -4,18 +4,24 @@ Simple UserResolver for Odoo integration with Vanna 2.0
 from vanna.core.user.resolver import UserResolver
 from vanna.core.user import User, RequestContext
 
+from .vanna_cache import TTLCache
+
 
 class OdooUserResolver(UserResolver):
-    """UserResolver that creates User from Odoo environment"""
+    """UserResolver that creates User from the Odoo environment of the request"""
     
-    def __init__(self, env):
+    def __init__(self, cache_size: int = 256, cache_ttl: float = 30.0):
         """
-        Initialize with Odoo environment
+        Initialize the resolver
         
         Args:
-            env: Odoo environment
+            cache_size: Maximum number of resolved users kept in memory
+            cache_ttl: Seconds a resolved user is reused before reading it again
         """
-        self.env = env
+        super().__init__()
+        
+        # Resolved users keyed by (dbname, uid)
+        self._cache = TTLCache(cache_size, cache_ttl)
     
     async def resolve_user(self, request_context: RequestContext) -> User:
         """
@@ -23,19 +29,26 @@ class OdooUserResolver(UserResolver):
         
         Args:
             request_context: Request context (contains Odoo env in metadata)
-            
+        
         Returns:
             User object from Odoo
         """
-        # Get Odoo env from metadata or use stored one
-        env = request_context.metadata.get('odoo_env', self.env)
+        # Get Odoo env from metadata
+        env = request_context.metadata['odoo_env']
+        key = (env.cr.dbname, env.uid)
+        
+        user = self._cache.get(key)
+        if user is not None:
+            return user
         
         # Get current Odoo user
         odoo_user = env.user
         
-        return User(
+        user = User(
             id=str(odoo_user.id),
             email=odoo_user.email or '',
             group_memberships=[]  # Can be enhanced to get actual Odoo groups
         )
-
+        self._cache.put(key, user)
+        
+        return user
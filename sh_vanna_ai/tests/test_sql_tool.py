@@ -0,0 +1,86 @@
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.sh_vanna_ai.models.vanna_sql_tool import OdooSqlTool
+
+
+@tagged('post_install', '-at_install')
+class TestValidateSql(TransactionCase):
+    """Safety checks applied to LLM generated SQL before it is executed"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tool = OdooSqlTool()
+
+    def assertRejected(self, sql):
+        result = self.tool._validate_sql(sql)
+        self.assertFalse(result['valid'], sql)
+        self.assertTrue(result['error'])
+
+    def test_select_is_valid(self):
+        result = self.tool._validate_sql("SELECT id, name FROM res_partner")
+        self.assertTrue(result['valid'])
+
+    def test_identifiers_containing_keywords(self):
+        result = self.tool._validate_sql(
+            "SELECT execution_time, last_update, created_at FROM t"
+        )
+        self.assertTrue(result['valid'])
+
+    def test_backslash_quote_injection(self):
+        # sqlparse reads \' as an escaped quote, PostgreSQL does not
+        self.assertRejected("SELECT 'a\\'; COMMIT; DROP TABLE res_partner; --'")
+        self.assertRejected("SELECT 'a\\'; DELETE FROM res_users; --'")
+
+    def test_multi_statement(self):
+        self.assertRejected("SELECT 1; SELECT 2")
+        self.assertRejected("SELECT 1; COMMIT")
+
+    def test_not_select(self):
+        self.assertRejected("UPDATE res_partner SET name = 'x'")
+        self.assertRejected("WITH x AS (DELETE FROM t RETURNING *) SELECT * FROM x")
+        self.assertRejected("")
+
+    def test_keywords_in_literals_and_comments(self):
+        self.assertRejected("SELECT id FROM res_partner WHERE name = 'drop table'")
+        self.assertRejected("SELECT id FROM res_partner -- delete\n")
+        self.assertRejected("SELECT id /* truncate */ FROM res_partner")
+        self.assertRejected("SELECT * FROM res_partner FOR UPDATE")
+
+    def test_limit_detection(self):
+        self.assertTrue(self.tool._validate_sql("SELECT id FROM t LIMIT 5")['has_limit'])
+        self.assertTrue(self.tool._validate_sql("select id from t limit 5 offset 2")['has_limit'])
+        self.assertFalse(self.tool._validate_sql("SELECT id FROM t")['has_limit'])
+        # A LIMIT inside a subquery does not bound the outer result
+        self.assertFalse(
+            self.tool._validate_sql("SELECT * FROM (SELECT id FROM t LIMIT 2) s")['has_limit']
+        )
+        # Nor does the word in a column alias or string
+        self.assertFalse(self.tool._validate_sql("SELECT 'limit' AS limited FROM t")['has_limit'])
+
+
+@tagged('post_install', '-at_install')
+class TestFormatResults(TransactionCase):
+    """Text given to the LLM for a query result"""
+
+    def test_format(self):
+        text = OdooSqlTool()._format_results_for_llm({
+            'columns': ['id', 'name'],
+            'rows': [(1, 'Azure'), (2, None)],
+            'count': 2,
+            'has_more': True,
+        })
+        self.assertEqual(text, "\n".join([
+            "Showing the first 2 result(s), more are available:",
+            "",
+            "id | name",
+            "---------",
+            "1 | Azure",
+            "2 | NULL",
+        ]))
+
+    def test_no_rows(self):
+        text = OdooSqlTool()._format_results_for_llm({
+            'columns': ['id'], 'rows': [], 'count': 0, 'has_more': False,
+        })
+        self.assertEqual(text, "No results found.")